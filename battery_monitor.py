@@ -23,6 +23,10 @@ has not been plugged into power.  If it has not, then a "shutdown -h now"" is ru
 If power was re-established then the system will abort out of the shutdown and continue to monitor
 the UPS.
 
+Sampling, the checks and the notifications run as asyncio tasks, so a slow notify-send never holds
+up reading the UPS.  The sampler wakes the checks as soon as the battery crosses a threshold, and you
+can force an immediate check with kill -USR1 <pid>.  kill -TERM <pid> stops the monitor cleanly.
+
 Both UPS's use the i2c bus.  The UPS S3 uses address 0x41, while the HAT uses 0x43 by default.
 Change the appropriate two lines below to reflect the correct i2c address of your UPS.
 
@@ -37,129 +41,578 @@ sudo crontab -e
 ------------------------------------------------------------------------------------------------
 """
 
+import asyncio
+import logging
+import os
+import signal
 import time
+import struct
+from collections import deque
+from dataclasses import dataclass
+from statistics import median
+from enum import Enum
+from pathlib import Path
+import subprocess
 import board
+import busio
 from adafruit_ina219 import ADCResolution, BusVoltageRange, INA219
-import subprocess
 
 # User variables
 battery_is_low = 25.00 # Initial Notification Warning
 battery_shutdown = 10.00 # Battery is criticaly low, will shutdown unless power is plugged in.
 battery_check_interval = 10 # In seconds
+sample_interval = 1 # In seconds, how often the sampler task reads the UPS
+stale_samples = 5 # Warn if the latest reading is older than this many sample intervals
+smoothing_window = 16 # Number of samples the battery percentage is smoothed over before checking thresholds
+alert_repeat_interval = 60 # In seconds, minimum time before the same alert is shown again
+countdown_check_interval = 1 # In seconds, how often power is re-checked during the shutdown countdown
+plugged_in_current = -20 # In mA, current above this (little or no draw from the battery) means the UPS is plugged in
+on_battery_current = -50 # In mA, once plugged in, current below this means we are back on the battery
 i2c_address=0x43 # UPS i2c address
+i2c_frequency = 400_000 # In Hz, INA219 supports fast-mode (400kHz) and above
 debug = False
 
+# Readings are only logged in debug mode, warnings and alerts are always logged
+logging.basicConfig(format="%(message)s")
+log = logging.getLogger("battery")
+log.setLevel(logging.DEBUG if debug else logging.INFO)
+
+# Run the bus in fast-mode instead of the 100kHz default.
+# On the Pi the kernel driver sets the actual clock, so also add this to /boot/firmware/config.txt
+# (/boot/config.txt on older releases) and reboot:  dtparam=i2c_arm_baudrate=400000
+i2c_bus = busio.I2C(board.SCL, board.SDA, frequency=i2c_frequency)
+
+# INA219 result registers
+_REG_SHUNTVOLTAGE = 0x01
+_REG_BUSVOLTAGE = 0x02
+_REG_POWER = 0x03
+_REG_CURRENT = 0x04
+_REG_CALIBRATION = 0x05
+
+# INA219 conversion time in seconds for each ADC resolution setting (datasheet table 5)
+_CONVERSION_TIME = {
+    ADCResolution.ADCRES_9BIT_1S: 0.000084,
+    ADCResolution.ADCRES_10BIT_1S: 0.000148,
+    ADCResolution.ADCRES_11BIT_1S: 0.000276,
+    ADCResolution.ADCRES_12BIT_1S: 0.000532,
+    ADCResolution.ADCRES_12BIT_2S: 0.00106,
+    ADCResolution.ADCRES_12BIT_4S: 0.00213,
+    ADCResolution.ADCRES_12BIT_8S: 0.00426,
+    ADCResolution.ADCRES_12BIT_16S: 0.00851,
+    ADCResolution.ADCRES_12BIT_32S: 0.01702,
+    ADCResolution.ADCRES_12BIT_64S: 0.03405,
+    ADCResolution.ADCRES_12BIT_128S: 0.0681,
+}
 
-i2c_bus = board.I2C()  # uses board.SCL and board.SDA
+# INA219 with a single call that pulls all four result registers.
+# The property accessors in the adafruit driver each take the bus lock and do their own
+# transfer (current and power also rewrite the calibration register first), so a full
+# set of readings cost 7 I2C transactions including the overflow check.
+# read_full() takes the bus lock once, rewrites calibration once and reads each register
+# with a repeated-start write/read. The INA219 does not auto-increment its register
+# pointer, so one 8-byte burst from 0x01 would just return the shunt register four times.
+# read_bus() is the cheap path: a single 2-byte read of the bus voltage register.
+class BatchedINA219(INA219):
+    def __init__(self, i2c_bus, addr=0x40):
+        super().__init__(i2c_bus, addr)
+        self._reg_buf = bytearray(2)
+        self._status_buf = bytearray(2)
+        self._result_buf = bytearray(8)
+        self.conversion_timeout = 0.3
 
-#ina219 = INA219(i2c_bus, 0x41) # Used for Pi UPS S3
-ina219 = INA219(i2c_bus, i2c_address) # Used for Pi UPS HAT (c)
+    # Sets both ADC resolutions and the read_when_ready() timeout to match.
+    # In shunt and bus continuous mode CNVR is only set once both conversions are done,
+    # so a full cycle takes the bus plus the shunt conversion time (136ms at 128 samples).
+    # Allow twice that, with a 10ms floor for polling and bus latency at the fast settings.
+    def set_adc_resolution(self, resolution):
+        self.bus_adc_resolution = resolution
+        self.shunt_adc_resolution = resolution
+        self.conversion_timeout = max(0.01, 2 * 2 * _CONVERSION_TIME[resolution])
 
-if debug == True:
-    print("ina219 test")
+    # Checks the CNVR bit (bit 1 of the bus voltage register). The INA219 sets it when a
+    # conversion completes and clears it when the power register is read, which read_full() does.
+    def is_conversion_ready(self):
+        reg_buf = self._reg_buf
+        status_buf = self._status_buf
+        with self.i2c_device as i2c:
+            reg_buf[0] = _REG_BUSVOLTAGE
+            i2c.write_then_readinto(reg_buf, status_buf, out_end=1)
+        return (status_buf[1] & 0x02) != 0
+
+    # Returns (bus_voltage, shunt_voltage, current, power, overflow) from one pass over the bus.
+    # Units match the adafruit properties: volts, volts, mA, watts.
+    def read_full(self):
+        buf = self._result_buf
+        reg_buf = self._reg_buf
+        with self.i2c_device as i2c:
+            # A sharp load can reset the INA219 and clear calibration, same as the driver guards against
+            i2c.write(bytes((_REG_CALIBRATION, self._cal_value >> 8, self._cal_value & 0xFF)))
+            for offset, reg in enumerate((_REG_SHUNTVOLTAGE, _REG_BUSVOLTAGE, _REG_POWER, _REG_CURRENT)):
+                reg_buf[0] = reg
+                i2c.write_then_readinto(reg_buf, buf, out_end=1, in_start=offset * 2, in_end=offset * 2 + 2)
+        raw_shunt, raw_bus, raw_power, raw_current = struct.unpack('>hHHh', buf)
+        bus_voltage = (raw_bus >> 3) * 0.004  # drop CNVR and OVF, 4mV per bit
+        shunt_voltage = raw_shunt * 0.00001  # 10uV per bit
+        current = raw_current * self._current_lsb
+        power = raw_power * self._power_lsb
+        return bus_voltage, shunt_voltage, current, power, bool(raw_bus & 0x01)
+
+    # Returns (bus_voltage, overflow) from the bus voltage register alone.
+    # There is no CNVR wait here: only reading the power register clears that bit.
+    def read_bus(self):
+        reg_buf = self._reg_buf
+        status_buf = self._status_buf
+        with self.i2c_device as i2c:
+            reg_buf[0] = _REG_BUSVOLTAGE
+            i2c.write_then_readinto(reg_buf, status_buf, out_end=1)
+        raw_bus = (status_buf[0] << 8) | status_buf[1]
+        return (raw_bus >> 3) * 0.004, bool(raw_bus & 0x01)
+
+    # Waits for a fresh conversion and then reads it with read_full().
+    # If no conversion completes within timeout seconds TimeoutError (an OSError) is raised,
+    # so a stuck INA219 is retried and counted as a lost sample like any other I2C failure
+    # instead of the same registers being passed off as a new reading.
+    # The timeout defaults to conversion_timeout, which set_adc_resolution() keeps in step with the ADC settings.
+    def read_when_ready(self, timeout=None):
+        if timeout is None:
+            timeout = self.conversion_timeout
+        deadline = time.monotonic() + timeout
+        while not self.is_conversion_ready():
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"no INA219 conversion within {timeout * 1000:.0f}ms")
+            time.sleep(0.001)
+        return self.read_full()
+
+#ina219 = BatchedINA219(i2c_bus, 0x41) # Used for Pi UPS S3
+ina219 = BatchedINA219(i2c_bus, i2c_address) # Used for Pi UPS HAT (c)
+
+if log.isEnabledFor(logging.DEBUG):
+    log.debug("ina219 test")
     # display some of the advanced field (just to test)
-    print("Config register:")
-    print("  bus_voltage_range:    0x%1X" % ina219.bus_voltage_range)
-    print("  gain:                 0x%1X" % ina219.gain)
-    print("  bus_adc_resolution:   0x%1X" % ina219.bus_adc_resolution)
-    print("  shunt_adc_resolution: 0x%1X" % ina219.shunt_adc_resolution)
-    print("  mode:                 0x%1X" % ina219.mode)
-    print("")
+    log.debug("Config register:")
+    log.debug("  bus_voltage_range:    0x%1X", ina219.bus_voltage_range)
+    log.debug("  gain:                 0x%1X", ina219.gain)
+    log.debug("  bus_adc_resolution:   0x%1X", ina219.bus_adc_resolution)
+    log.debug("  shunt_adc_resolution: 0x%1X", ina219.shunt_adc_resolution)
+    log.debug("  mode:                 0x%1X", ina219.mode)
+    log.debug("")
 
 # optional : change configuration to use 32 samples averaging for both bus voltage and shunt voltage
-ina219.bus_adc_resolution = ADCResolution.ADCRES_12BIT_32S
-ina219.shunt_adc_resolution = ADCResolution.ADCRES_12BIT_32S
+# The sampler task adjusts this as the battery drains, see select_adc_resolution()
+ina219.set_adc_resolution(ADCResolution.ADCRES_12BIT_32S)
 # optional : change voltage range to 16V
 ina219.bus_voltage_range = BusVoltageRange.RANGE_16V
 
+# Battery voltage to percentage mapping: offset is the empty voltage, scale is 100 / (full - empty).
+# Change these depending on the UPS you are using.
+#_BATT_OFFSET, _BATT_SCALE = 9.0, 100.0 / (12.6 - 9.0) # Use for Pi5 WaveShare UPS S3
+_BATT_OFFSET, _BATT_SCALE = 3.0, 100.0 / (4.1 - 3.0) # Use for Pi Zero WaveShare UPS HAT (C)
+
 # Returns the remaining battery life of the UPS
-# Change the return depending on the UPS you are using.
 def get_battery_percentage(bus_voltage):
-    #return ((bus_voltage - 9.0) / (12.6 - 9.0)) * 100 # Use for Pi5 WaveShare UPS S3
-    return ((bus_voltage - 3.0) / (4.1 - 3.0)) * 100 # Use for Pi Zero WaveShare UPS HAT (C)
+    return (bus_voltage - _BATT_OFFSET) * _BATT_SCALE
+
+# All of the per-sample arithmetic in one place.
+# Returns (amps, power_calc, battery_percentage) for a bus voltage and a current in mA.
+def evaluate(bus_voltage, current):
+    amps = current * 1e-3
+    return amps, bus_voltage * amps, get_battery_percentage(bus_voltage)
+
+# Battery charge level, the main loop only acts when this changes
+class BatteryState(Enum):
+    OK = "ok"
+    LOW = "low"
+    CRITICAL = "critical"
+
+# Work out the battery state from the percentage alone, whether the UPS is plugged in is tracked by is_charging()
+def get_battery_state(battery_percentage):
+    if battery_percentage <= battery_shutdown:
+        return BatteryState.CRITICAL
+    if battery_percentage <= battery_is_low:
+        return BatteryState.LOW
+    return BatteryState.OK
+
+# Work out whether the UPS is plugged in from the discharge current (mA, negative while running off of the battery).
+# A full pack on mains sits at about 0mA rather than charging, so anything short of a real draw
+# from the battery counts as plugged in. The gap between plugged_in_current and on_battery_current
+# keeps noise from flipping back and forth.
+def is_charging(current, was_charging):
+    if was_charging:
+        return current > on_battery_current
+    return current > plugged_in_current
+
+# Resolve an icon file once at startup. If it's missing fall back to a theme icon name
+# rather than having notify-send look for a file that isn't there on every alert.
+def resolve_icon(path, fallback):
+    try:
+        return str(Path(path).expanduser().resolve(strict=True))
+    except OSError:
+        log.warning("Icon %s not found, using the %s theme icon", path, fallback)
+        return fallback
+
+# notify-send from libnotify 0.7.9 on can print the notification id (-p) and update a notification
+# in place (--replace-id). Older versions reject those options and show nothing at all, so check
+# --help once at startup and only use them when they are listed.
+def notify_send_supports_replace():
+    try:
+        result = subprocess.run(['notify-send', '--help'], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    help_text = result.stdout + result.stderr
+    return '--print-id' in help_text and '--replace-id' in help_text
+
+# notify-send arguments shared by every alert, the message is appended when sending
+ICON_LOW = resolve_icon('/home/admin/.local/share/icons/candy-icons/status/scalable/battery-030.svg', 'battery-low')
+ICON_CRITICAL = resolve_icon('/home/admin/.local/share/icons/candy-icons/status/scalable/battery-020.svg', 'battery-caution')
+_NOTIFY_REPLACE = notify_send_supports_replace()
+_ARGV_LOW = ('notify-send', '-i', ICON_LOW, '-t', '2000', 'Battery Alert')
+if _NOTIFY_REPLACE:
+    _ARGV_CRIT = ('notify-send', '--urgency=critical', '-p', '-i', ICON_CRITICAL, 'Battery Critical')
+else:
+    log.info("notify-send can't update notifications in place, each alert will open a new one")
+    _ARGV_CRIT = ('notify-send', '--urgency=critical', '-i', ICON_CRITICAL, 'Battery Critical')
+
+# Run notify-send with posix_spawn, which skips copying the interpreter with fork().
+# subprocess (and asyncio's subprocess support on top of it) still forks on Python 3.9,
+# and never uses posix_spawn with its default close_fds=True.
+# The output pipe is read and the child reaped in worker threads so it doesn't linger
+# as a zombie and the event loop keeps sampling while notify-send runs.
+# Returns what notify-send printed if capture_output is set, otherwise None.
+async def _notify(argv, capture_output=False):
+    file_actions = None
+    if capture_output:
+        read_fd, write_fd = os.pipe()
+        file_actions = [(os.POSIX_SPAWN_DUP2, write_fd, 1)]
+    try:
+        pid = os.posix_spawnp(argv[0], argv, os.environ, file_actions=file_actions)
+    except OSError as e:
+        log.warning("Could not run notify-send: %s", e)
+        if capture_output:
+            os.close(read_fd)
+            os.close(write_fd)
+        return None
+    stdout = None
+    if capture_output:
+        os.close(write_fd)
+        with os.fdopen(read_fd, 'rb') as pipe:
+            stdout = await asyncio.to_thread(pipe.read)
+    await asyncio.to_thread(os.waitpid, pid, 0)
+    return stdout
+
+# Insert --replace-id before the summary so notify-send updates an existing notification
+def _with_replace_id(argv, replace_id):
+    if replace_id is None or not _NOTIFY_REPLACE:
+        return argv
+    return (*argv[:-1], f'--replace-id={replace_id}', argv[-1])
+
+# time.monotonic() of the last alert sent for each key
+_last_sent = {}
 
-# Use notify-send to send a desktop notification
-def send_alert(message):
-    subprocess.run(['notify-send', '-i', '/home/admin/.local/share/icons/candy-icons/status/scalable/battery-030.svg','-t','2000','Battery Alert', message])
+# Use notify-send to send a desktop notification.
+# Alerts given a key are only sent once every alert_repeat_interval seconds per key,
+# so a low battery doesn't fork notify-send on every check. Alerts without a key always go out.
+# replace_id updates that notification instead of opening a new one.
+async def send_alert(message, key=None, replace_id=None):
+    if key is not None:
+        now = time.monotonic()
+        if now - _last_sent.get(key, float('-inf')) < alert_repeat_interval:
+            return
+        _last_sent[key] = now
+    await _notify((*_with_replace_id(_ARGV_LOW, replace_id), message))
 
 # Use notify-send to send desktop notification. Critical messages will not disappear.
-def send_critical_alert(message):
-    subprocess.run(['notify-send','--urgency=critical', '-i', '/home/admin/.local/share/icons/candy-icons/status/scalable/battery-020.svg','Battery Critical', message])
+# Returns the notification id, pass it back as replace_id to update the same notification in place.
+# Returns None if this notify-send can't do that, the next alert then just opens a new notification.
+async def send_critical_alert(message, replace_id=None):
+    argv = (*_with_replace_id(_ARGV_CRIT, replace_id), message)
+    if not _NOTIFY_REPLACE:
+        await _notify(argv)
+        return None
+    stdout = await _notify(argv, capture_output=True)
+    try:
+        return int(stdout)
+    except (TypeError, ValueError):
+        return None
 
 # Execute system shutdown
-def shutdown_system():
-    subprocess.run(['sudo', 'shutdown', '-h', 'now'])
+async def shutdown_system():
+    proc = await asyncio.create_subprocess_exec('sudo', 'shutdown', '-h', 'now')
+    await proc.wait()
 
-def battery_low():
-    # 10-second countdown at a 3 second notificaton interval
-    for i in range(10, 0, -3):
-        print(f"Shutting down in {i} seconds...")
-        send_alert(f"Shutting down in {i} seconds...")
-        # TODO: Probably need to insert a battery check here to make sure user hasn't plugge into power.
-        time.sleep(3)
+# One set of UPS readings published by the sampler task.
+# timestamp is the time.monotonic() value when the registers were read.
+# The derived values come from evaluate() once per sample and are reused by the readout and the threshold checks.
+@dataclass(frozen=True)
+class Reading:
+    bus_voltage: float  # voltage on V- (load side)
+    shunt_voltage: float  # voltage between V+ and V- across the shunt
+    current: float  # current in mA
+    power: float  # power in watts
+    overflow: bool
+    timestamp: float
+    amps: float  # current in A
+    power_calc: float  # bus_voltage * amps, negative while running off of UPS
+    battery_percentage: float
+    smoothed_percentage: float  # median battery percentage over the last smoothing_window samples
+
+# The most recent Reading. Only the event loop thread touches it, so no lock is needed.
+_latest_reading = None
+
+# Returns the most recent Reading from the sampler task
+def get_latest_reading():
+    return _latest_reading
+
+# Sleep until timeout seconds pass or wake_event is set. Returns True if woken early.
+async def wait_for_wake(wake_event, timeout):
+    try:
+        await asyncio.wait_for(wake_event.wait(), timeout)
+    except asyncio.TimeoutError:
+        return False
+    wake_event.clear()
+    return True
+
+# Read the UPS, retrying I2C errors with a short exponential backoff (10, 20, 40ms)
+# so a glitch on the bus doesn't take the whole monitor down. Returns None if every attempt failed.
+# read is the BatchedINA219 method to call, read_when_ready for everything or read_bus for just the voltage.
+# This blocks on the bus, so it is run in a worker thread with asyncio.to_thread().
+def read_with_retry(read, attempts=3):
+    for attempt in range(attempts):
+        try:
+            return read()
+        except OSError as e:
+            log.warning("I2C read failed (attempt %d of %d): %s", attempt + 1, attempts, e)
+            time.sleep(0.01 * (1 << attempt))
+    log.error("Giving up on this sample after %d failed I2C reads", attempts)
+    return None
+
+# Picks the ADC averaging for the current charge level. Well above battery_is_low a single
+# sample is plenty, close to battery_shutdown use full 128 sample averaging.
+# In between keep whatever is set so it doesn't flip back and forth around one threshold.
+def select_adc_resolution(battery_percentage, resolution):
+    if battery_percentage > battery_is_low + 10:
+        return ADCResolution.ADCRES_12BIT_1S
+    if battery_percentage < battery_shutdown + 5:
+        return ADCResolution.ADCRES_12BIT_128S
+    return resolution
+
+# Reads the UPS every sample_interval seconds as its own task, so slow notifications
+# in the main loop don't hold up sampling. If a sample can't be read the previous one stays published.
+# The median over the last smoothing_window samples is published with each reading so a single
+# noisy sample near a threshold doesn't trigger an alert.
+# When the battery state or charging changes the main loop is woken straight away instead of at its next check.
+# While the battery is healthy and running normally only the bus voltage register is read.
+# Shunt voltage, current and power carry over from the last full read, which is refreshed
+# once per battery_check_interval so plugging in is still picked up.
+async def sample_loop(first_reading, wake_event):
+    global _latest_reading
+    window = deque(maxlen=smoothing_window)
+    state = None
+    charging = False
+    adc_resolution = ADCResolution.ADCRES_12BIT_32S
+    full_read_every = max(1, round(battery_check_interval / sample_interval))
+    samples_since_full = full_read_every
+    last_full = None
+    next_sample = time.monotonic()
+    while True:
+        await asyncio.sleep(max(0, next_sample - time.monotonic()))
+        next_sample += sample_interval
+        fast_path = (not debug and last_full is not None and state == BatteryState.OK and not charging
+                     and samples_since_full < full_read_every
+                     and _latest_reading.smoothed_percentage >= battery_is_low + 5)
+        if fast_path:
+            values = await asyncio.to_thread(read_with_retry, ina219.read_bus)
+            if values is None:
+                continue # keep the last good reading published and try again next sample
+            bus_voltage, overflow = values
+            _, shunt_voltage, current, power, _ = last_full
+            samples_since_full += 1
+        else:
+            values = await asyncio.to_thread(read_with_retry, ina219.read_when_ready)
+            if values is None:
+                continue
+            bus_voltage, shunt_voltage, current, power, overflow = last_full = values
+            samples_since_full = 0
+        timestamp = time.monotonic()
+        amps, power_calc, battery_percentage = evaluate(bus_voltage, current)
+        window.append(battery_percentage)
+        _latest_reading = Reading(bus_voltage, shunt_voltage, current, power, overflow, timestamp,
+                                  amps, power_calc, battery_percentage, median(window))
+        first_reading.set()
+        new_state = get_battery_state(_latest_reading.smoothed_percentage)
+        now_charging = is_charging(current, charging)
+        if state is not None and (new_state != state or now_charging != charging):
+            wake_event.set()
+        state = new_state
+        charging = now_charging
+        # Only touch the config register when the averaging actually needs to change
+        new_resolution = select_adc_resolution(_latest_reading.smoothed_percentage, adc_resolution)
+        if new_resolution != adc_resolution:
+            try:
+                await asyncio.to_thread(ina219.set_adc_resolution, new_resolution) # blocking I2C writes
+                adc_resolution = new_resolution
+            except OSError as e:
+                log.warning("Could not change ADC resolution, will retry next sample: %s", e)
+
+# True if the latest reading shows the UPS has been plugged back in
+def power_restored():
+    return is_charging(get_latest_reading().current, False)
+
+# 10-second countdown at a 3 second notificaton interval.
+# Power is re-checked every countdown_check_interval seconds so the countdown can be aborted
+# as soon as the user plugs in.
+# The countdown is shown by updating the notification_id notification in place rather than
+# stacking up a new one every 3 seconds.
+# Returns (power_restored, notification_id) so the caller can update the same notification again.
+async def battery_low(notification_id=None, countdown=10, alert_interval=3):
+    start = time.monotonic()
+    end = start + countdown
+    next_alert = start
+    next_check = start
+    while True:
+        now = time.monotonic()
+        if now >= end:
+            return False, notification_id
+        if now >= next_alert:
+            log.warning("Shutting down in %d seconds...", round(end - now))
+            notification_id = await send_critical_alert(f"Shutting down in {round(end - now)} seconds...",
+                                                        replace_id=notification_id) or notification_id
+            next_alert += alert_interval
+        if power_restored():
+            return True, notification_id
+        next_check += countdown_check_interval
+        await asyncio.sleep(max(0, min(next_check, end) - time.monotonic()))
 
 # If the battery has dropped below the battery_shutdown level
 # Initiate a shutdown of the computer.
 # Pause for 5 seconds so the user can read the message.
-def system_shutdown():
-    print("System is shutting down!")
-    time.sleep(5) # Pause for a moment in case user has plugged into power, let ina219 balance out.
-    subprocess.run(['sudo', 'shutdown', '-h', 'now'])
+async def system_shutdown():
+    log.critical("System is shutting down!")
+    await asyncio.sleep(5) # Pause for a moment in case user has plugged into power, let ina219 balance out.
+    await shutdown_system()
 
 # measure and display loop
-while True:
-    bus_voltage = ina219.bus_voltage  # voltage on V- (load side)
-    shunt_voltage = ina219.shunt_voltage  # voltage between V+ and V- across the shunt
-    current = ina219.current  # current in mAa
-    power = ina219.power  # power in watts
-    #percent = ((bus_voltage - 9.0) / (12.6 - 9.0)) * 100 # Use with UPS S3
-    percent = (bus_voltage - 3.0) / (4.1 - 3.0)*100 # Use with the Pi Zero's UPS HAT (C)
-    if(percent > 98):percent = 100
-    if(percent < 0):percent = 0
-
-    # INA219 measure bus voltage on the load side. So PSU voltage = bus_voltage + shunt_voltage
-    print("Voltage (VIN+) : {:6.3f}   V".format(bus_voltage + shunt_voltage))
-    print("Voltage (VIN-) : {:6.3f}   V".format(bus_voltage))
-    print("Shunt Voltage  : {:8.5f} V".format(shunt_voltage))
-    print("Shunt Current  : {:7.4f}  A".format(current / 1000))
-    print("Power Calc.    : {:8.5f} W".format(bus_voltage * (current / 1000)))
-    print("Power Register : {:6.3f}   W".format(power))
-    print("Percent        : {:6.2f}%".format(percent))
-    print("")
-
-    # Check internal calculations haven't overflowed (doesn't detect ADC overflows)
-    if ina219.overflow:
-        print("Internal Math Overflow Detected!")
-        print("")
-
-    # Run the get_battery_percentage function
-    battery_percentage = get_battery_percentage(bus_voltage)
-
-    # Used to determine if power has been restored to the UPS.
-    # A negative voltage means power has not been restored, we are still running off of UPS.
-    get_power_calc = bus_voltage * (current / 1000)
-
-    if get_power_calc <= -5.00:
-        print("No input voltage detected")
-        send_alert(f"We are running on the Pi5's UPS battery: {battery_percentage:.2f}% left on battery")
-
-    # Send alert if battery percentage is below "battery_is_low user variable
-    if battery_percentage <= battery_is_low:
-        print("Ran Battery Percentage")
-        send_alert(f"Pi5 UPS Battery Low: {battery_percentage:.2f}% Remaining! Charge ASAP!")
-
-    # Send alert that battery has dropped below battery_shutdown user variable and will shutdown unless plugged into power source.
-    # If low battery alert was sent, system is in 10 sec. countdown.  Check one final time to see if user
-    # plugged in power.  If yes, then go back to standard status checking.
-    # If no, then initiate a system shutdown.
-    if battery_percentage <= float(battery_shutdown):
-        send_critical_alert(f"Battery critically low: {battery_percentage:.2f}% remaining! Plug into power or system will shutdown in 10 seconds.")
-        battery_low()
-        if battery_percentage <=battery_shutdown and get_power_calc <=-1.00: # check to see if power has power been re-established?
-            send_critical_alert(f"Battery is critical: {battery_percentage:.2f}% System is Shutting down...")
-            #system_shutdown()
-            break
-        else:
-            send_alert(f"Battery is charging: {battery_percentage:.2f}%")
+# Runs on a monotonic deadline so the time spent sending notifications doesn't stretch
+# the interval between checks.
+# Alerts are only sent when the battery state or charging changes, not on every check.
+async def monitor_loop(first_reading, wake_event):
+    await first_reading.wait()
+    state = BatteryState.OK
+    charging = False
+    stale = False
+    next_tick = time.monotonic()
+    while True:
+        reading = get_latest_reading()
+        battery_percentage = reading.smoothed_percentage
+
+        # The sampler keeps the last good reading when the UPS can't be read, so make sure
+        # it's obvious when the checks below are running on old data.
+        age = time.monotonic() - reading.timestamp
+        if age > stale_samples * sample_interval:
+            if not stale:
+                log.error("No new UPS reading for %.0f seconds, battery checks are using old data", age)
+                stale = True
+            await send_alert(f"Can't read the UPS, battery level last seen at {battery_percentage:.2f}%", key="stale_reading")
+        elif stale:
+            log.info("UPS readings have resumed")
+            stale = False
+
+        # Only build the readout when debug logging is on
+        if log.isEnabledFor(logging.DEBUG):
+            # Clamp for display; anything above 98% snaps to full since the pack never quite reaches 4.1V under load
+            percent = reading.battery_percentage
+            percent = 0.0 if percent < 0.0 else 100.0 if percent > 98.0 else percent
+
+            # INA219 measure bus voltage on the load side. So PSU voltage = bus_voltage + shunt_voltage
+            # Built as one message so the whole readout goes out in a single write
+            log.debug(
+                f"Voltage (VIN+) : {reading.bus_voltage + reading.shunt_voltage:6.3f}   V\n"
+                f"Voltage (VIN-) : {reading.bus_voltage:6.3f}   V\n"
+                f"Shunt Voltage  : {reading.shunt_voltage:8.5f} V\n"
+                f"Shunt Current  : {reading.amps:7.4f}  A\n"
+                f"Power Calc.    : {reading.power_calc:8.5f} W\n"
+                f"Power Register : {reading.power:6.3f}   W\n"
+                f"Percent        : {percent:6.2f}%\n"
+                f"Smoothed       : {battery_percentage:6.2f}%\n"
+            )
+
+        # Check internal calculations haven't overflowed (doesn't detect ADC overflows)
+        if reading.overflow:
+            log.warning("Internal Math Overflow Detected!")
+
+        new_state = get_battery_state(battery_percentage)
+        now_charging = is_charging(reading.current, charging)
+        plugged_in = now_charging and not charging
+        unplugged = charging and not now_charging
+        charging = now_charging
+
+        if plugged_in:
+            log.info("Input power detected")
+            if state != BatteryState.OK: # only worth saying if we had already warned about the battery
+                await send_alert(f"Battery is charging: {battery_percentage:.2f}%", key="charging")
+
+        # Power was unplugged, now running off of the battery. Always tell the user,
+        # a low battery alert sent before they plugged in mustn't swallow this one.
+        elif unplugged and new_state == BatteryState.LOW:
+            log.info("No input voltage detected")
+            await send_alert(f"Pi5 UPS Battery Low: {battery_percentage:.2f}% Remaining! Charge ASAP!")
+        elif unplugged and new_state == BatteryState.OK:
+            log.info("No input voltage detected")
+            await send_alert(f"We are running on the Pi5's UPS battery: {battery_percentage:.2f}% left on battery")
+
+        # Send alert that battery has dropped below battery_shutdown user variable and will shutdown unless plugged into power source.
+        # System goes into a 10 sec. countdown, re-checking for power as it goes.
+        # If the user plugs in, go back to standard status checking.
+        # If not, then initiate a system shutdown.
+        if new_state == BatteryState.CRITICAL and not charging and (new_state != state or unplugged):
+            notification_id = await send_critical_alert(f"Battery critically low: {battery_percentage:.2f}% remaining! Plug into power or system will shutdown in 10 seconds.")
+            power_restored_during_countdown, notification_id = await battery_low(notification_id)
+            if power_restored_during_countdown:
+                await send_alert(f"Battery is charging: {battery_percentage:.2f}%", replace_id=notification_id)
+                charging = True
+            else:
+                await send_critical_alert(f"Battery is critical: {battery_percentage:.2f}% System is Shutting down...",
+                                          replace_id=notification_id)
+                #await system_shutdown()
+                return
+
+        # Send alert if battery percentage has dropped below battery_is_low user variable.
+        # This goes out whether or not we think the UPS is plugged in.
+        elif new_state == BatteryState.LOW and state == BatteryState.OK and not unplugged:
+            log.info("Ran Battery Percentage")
+            await send_alert(f"Pi5 UPS Battery Low: {battery_percentage:.2f}% Remaining! Charge ASAP!", key="battery_low")
+
+        state = new_state
+
+        next_tick += battery_check_interval
+        now = time.monotonic()
+        if next_tick < now:
+            # Fell behind (e.g. after the shutdown countdown), skip the missed checks instead of bursting
+            next_tick += ((now - next_tick) // battery_check_interval + 1) * battery_check_interval
+        if await wait_for_wake(wake_event, max(0, next_tick - time.monotonic())):
+            next_tick = time.monotonic() # woken early, check now and count the next interval from here
+
+# Run the sampler and the monitor loop together.
+# SIGUSR1 forces an immediate check, SIGTERM stops the monitor cleanly.
+# If either task dies the other is stopped too and the error is raised, rather than
+# leaving the monitor checking a reading that will never change again.
+async def main():
+    loop = asyncio.get_running_loop()
+    first_reading = asyncio.Event()
+    wake_event = asyncio.Event()
+    sampler_task = asyncio.create_task(sample_loop(first_reading, wake_event))
+    monitor_task = asyncio.create_task(monitor_loop(first_reading, wake_event))
+    loop.add_signal_handler(signal.SIGUSR1, wake_event.set)
+    loop.add_signal_handler(signal.SIGTERM, monitor_task.cancel)
+    done, pending = await asyncio.wait((sampler_task, monitor_task), return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    if monitor_task in done and monitor_task.cancelled():
+        log.info("Battery monitor stopped")
+        return
+    if sampler_task in done:
+        log.critical("UPS sampler stopped unexpectedly, battery monitor is exiting")
+    for task in done:
+        task.result() # re-raise whatever stopped the task
 
-    time.sleep(battery_check_interval)
+asyncio.run(main())